@@ -1,17 +1,69 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
+import re
+import multiprocessing
+import queue
 import subprocess
-from threading import Thread
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Event
 import boto3
 import os
+import urllib3.connection
+from botocore.config import Config
 from datetime import datetime, timedelta, timezone
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlsplit
 
 DEFAULT_HOSTNAME = "127.0.0.1"
 DEFAULT_PORT = 3306
 DEFAULT_USER = "root"
 DEFAULT_RETENTION_DAYS = 7
+DEFAULT_UPLOAD_WORKERS = 8
+
+# Size of each multipart upload part. S3 allows at most 10,000 parts per upload,
+# each at least 5 MiB, so this also caps the size of a backup (64 MiB -> 640 GiB).
+DEFAULT_PART_SIZE_MB = 64
+MIN_PART_SIZE_MB = 5
+
+# Number of parts read ahead of the upload workers. Together with the parts being
+# uploaded, at most (workers + PREFETCH_PARTS) parts are held in memory.
+PREFETCH_PARTS = 2
+
+# Capacity of the pipes between mysqldump, pigz and us. Linux defaults to 64 KiB,
+# which limits every read from the pipe to 64 KiB.
+PIPE_SIZE = 1024 * 1024
+
+# How often to print upload progress, in bytes read from the dump
+PROGRESS_INTERVAL = 64 * 1024 * 1024
+
+# Timestamp embedded in backup file names: <prefix>-YYYYMMDD-HHMMSS.sql.gz
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+# Backup key after the prefix, capturing the timestamp. Also matches uncompressed
+# .sql backups made by older versions.
+BACKUP_KEY_PATTERN = r"-([0-9]{8}-[0-9]{6})\.sql(?:\.gz)?"
+
+# Maximum number of keys accepted by a single DeleteObjects call
+DELETE_BATCH_SIZE = 1000
+
+# Block size used when writing request bodies to sockets. http.client defaults to 8 KiB
+# and urllib3 to 16 KiB, which costs a syscall and GIL round trip per block.
+SEND_BUFFER_SIZE = 1024 * 1024
+
+# Socket timeout of HTTP connections we make ourselves, matching botocore's default
+HTTP_TIMEOUT = 60
+
+# Attempts per part when uploading over our own HTTP connections
+PART_UPLOAD_ATTEMPTS = 5
+
+# Seconds to wait for a part upload before assuming its worker died
+PART_TIMEOUT = 15 * 60
 
 # System databases we want to exclude
 SYSTEM_DATABASES = {
@@ -21,16 +73,55 @@ SYSTEM_DATABASES = {
     "sys"
 }
 
+# --- Import-time patches -----------------------------------------------------
+# Raise the default HTTP send block size to SEND_BUFFER_SIZE for every connection
+# opened by this process, before any S3 client is created.
+HTTPConnection.__init__.__defaults__ = tuple(
+    SEND_BUFFER_SIZE if x == 8192 else x for x in HTTPConnection.__init__.__defaults__
+)
+# urllib3 2.x declares its own keyword-only block size, which botocore's connections inherit
+if "blocksize" in (urllib3.connection.HTTPConnection.__init__.__kwdefaults__ or {}):
+    urllib3.connection.HTTPConnection.__init__.__kwdefaults__["blocksize"] = SEND_BUFFER_SIZE
+# -----------------------------------------------------------------------------
+
 class MySQLDumpStream:
-    def __init__(self, process: subprocess.Popen):
-        self.process = process
+    def __init__(self, *processes: subprocess.Popen):
+        """
+        Read the stdout of the last of `processes`, a pipeline fed by mysqldump.
+        Reaching the end of the stream raises if any of the processes failed.
+        """
+        self.processes = processes
+        self.stdout = processes[-1].stdout
         self.num_read = 0
 
-    def read(self, size=-1):
-        """ Read `size` bytes from mysqldump stdout """
-        buffer = self.process.stdout.read(size) if self.process.poll() is None else b''
-        self.num_read += len(buffer)
-        return buffer
+    def readinto(self, buffer) -> int:
+        """
+        Fill `buffer` from the dump process's stdout, returning the number of bytes read.
+        Reads until the buffer is full or the pipe reaches EOF, without polling the processes.
+        """
+        filled = 0
+        with memoryview(buffer) as view:
+            while filled < len(view):
+                count = self.stdout.readinto(view[filled:])
+                if not count:
+                    self.check_exit()
+                    break
+                filled += count
+        self.advance(filled)
+        return filled
+
+    def check_exit(self):
+        """ Wait for the processes to exit and raise if any of them failed """
+        for process in self.processes:
+            if process.wait() != 0:
+                raise Exception(f"{process.args[0]} failed with exit code {process.returncode}")
+
+    def advance(self, count: int):
+        """ Count `count` bytes as read, printing progress every PROGRESS_INTERVAL bytes """
+        previous = self.num_read
+        self.num_read += count
+        if self.num_read // PROGRESS_INTERVAL != previous // PROGRESS_INTERVAL:
+            print(f"Uploaded {self.num_read} bytes", end='\r')
 
 class EnvDefault(argparse.Action):
     def __init__(self, envvar, required=True, default=None, **kwargs):
@@ -46,96 +137,409 @@ class EnvDefault(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         setattr(namespace, self.dest, values)
 
-def get_user_databases(user: str, password: str | None, hostname: str, port: int) -> list[str]:
+def mysql_connection_args(user: str, hostname: str, port: int) -> list[str]:
+    """
+    Return the command line arguments connecting mysql/mysqldump to the server.
+    """
+    return [f"-u{user}", f"-h{hostname}", f"-P{port}"]
+
+def mysql_env(password: str | None) -> dict[str, str]:
+    """
+    Return the environment for mysql/mysqldump. The password is passed in MYSQL_PWD
+    rather than on the command line, where any user could read it from /proc.
+    """
+    env = dict(os.environ)
+    if password:
+        env["MYSQL_PWD"] = password
+    return env
+
+def get_user_databases(connection_args: list[str], env: dict[str, str]) -> list[str]:
     """
     Return a list of non-builtin databases from MariaDB/MySQL.
     """
 
-    cmd = [
-        "mysql",
-        f"-u{user}",
-        f"-h{hostname}",
-        f"-P{port}",
-        f"--password={password}" if password else "",
+    cmd = ["mysql"] + connection_args + [
         "-N",            # skip column names
         "-e", "SHOW DATABASES;"
     ]
-    result = subprocess.run(cmd, check=False, capture_output=True, text=True)
+    result = subprocess.run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
     if result.returncode != 0:
-        raise Exception(result.stderr)
-    all_dbs = result.stdout.strip().split("\n")
+        raise Exception(result.stderr.decode("utf-8", "replace"))
     # Filter out system databases
-    user_dbs = [db for db in all_dbs if db not in SYSTEM_DATABASES]
+    user_dbs = sorted(set(result.stdout.decode("utf-8", "replace").splitlines()) - SYSTEM_DATABASES)
     return user_dbs
 
-def open_dump_process(user: str, password: str, hostname: str, port: int, db_list: list) -> subprocess.Popen:
+def open_dump_process(connection_args: list[str], env: dict[str, str], db_list: list) -> subprocess.Popen:
     if not db_list:
         raise ValueError("No user databases found. Nothing to dump.")
 
+    cmd = ["mysqldump"] + connection_args + ["--databases"] + db_list
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, pipesize=PIPE_SIZE, env=env)
+    return process
+
+def open_compress_process(source: subprocess.Popen) -> subprocess.Popen:
+    """
+    Compress the stdout of `source` with pigz, which uses all online cores by default.
+    """
     cmd = [
-        "mysqldump",
-        f"-u{user}",
-        f"-h{hostname}",
-        f"-P{port}",
-        f"--password={password}" if password else "",
-        "--databases"
-    ] + db_list
-
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        "pigz",
+        "-1"             # favour speed, SQL dumps compress well regardless
+    ]
+
+    process = subprocess.Popen(cmd, stdin=source.stdout, stdout=subprocess.PIPE, pipesize=PIPE_SIZE)
+    # Only pigz should hold the read end of the dump pipe, so mysqldump sees it close
+    source.stdout.close()
     return process
 
-def cleanup_old_backups(
+class SharedMemoryReader(io.RawIOBase):
+    """ Seekable, read-only file object over a view of a shared memory segment """
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self.view) - self.position)
+        buffer[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, min(offset, len(self.view)))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        # Release the view so the segment can be closed, even if the body is still referenced
+        self.view.release()
+        super().close()
+
+def create_s3_client(endpoint_url: str | None):
+    """
+    Create an S3 client from a new session, keeping connections alive between
+    requests and retrying throttled or failed requests adaptively.
+    """
+    config = Config(
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": 5}
+    )
+    return boto3.session.Session().client("s3", endpoint_url=endpoint_url, config=config)
+
+# S3 client of an upload worker process, created by `init_upload_worker`
+worker_s3_client = None
+# Whether the worker sends parts with sendfile(2), see `upload_part_sendfile`
+worker_use_sendfile = False
+
+def init_upload_worker(endpoint_url: str | None):
+    """
+    Create the S3 client used by an upload worker process.
+    boto3 sessions are not fork-safe, so every worker builds its own.
+    """
+    global worker_s3_client, worker_use_sendfile
+    worker_s3_client = create_s3_client(endpoint_url)
+    # Zero-copy sends need a plaintext connection and shared memory backed by /dev/shm
+    worker_use_sendfile = (
+        sys.platform == "linux"
+        and endpoint_url is not None
+        and endpoint_url.startswith("http://")
+    )
+
+def upload_part(bucket: str, key: str, upload_id: str, part_number: int, shm_name: str, size: int) -> str:
+    """
+    Upload the first `size` bytes of shared memory segment `shm_name` as a part
+    of a multipart upload. Runs in an upload worker process. Returns the part's ETag.
+    """
+    if worker_use_sendfile:
+        return upload_part_sendfile(bucket, key, upload_id, part_number, shm_name, size)
+
+    shm = SharedMemory(name=shm_name)
+    try:
+        with SharedMemoryReader(shm.buf[:size]) as body:
+            response = worker_s3_client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+                Body=body
+            )
+    finally:
+        shm.close()
+    return response["ETag"]
+
+def upload_part_sendfile(bucket: str, key: str, upload_id: str, part_number: int, shm_name: str, size: int) -> str:
+    """
+    Upload a part to a plain HTTP endpoint through a presigned URL, sending the
+    shared memory segment straight to the socket with sendfile(2) so the part
+    never passes through Python. Returns the part's ETag.
+    botocore's retries do not apply here, so connection errors, throttling and
+    server errors are retried up to PART_UPLOAD_ATTEMPTS times with backoff.
+    """
+    url = urlsplit(worker_s3_client.generate_presigned_url(
+        "upload_part",
+        Params={"Bucket": bucket, "Key": key, "UploadId": upload_id, "PartNumber": part_number}
+    ))
+    with open(os.path.join("/dev/shm", shm_name), "rb") as segment:
+        for attempt in range(1, PART_UPLOAD_ATTEMPTS + 1):
+            connection = HTTPConnection(url.hostname, url.port, timeout=HTTP_TIMEOUT)
+            try:
+                connection.putrequest("PUT", f"{url.path}?{url.query}", skip_accept_encoding=True)
+                connection.putheader("Content-Length", str(size))
+                connection.endheaders()
+                # socket.sendfile, unlike os.sendfile, copes with the socket being
+                # non-blocking because of its timeout
+                connection.sock.sendfile(segment, 0, size)
+
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, HTTPException) as error:
+                failure = f"{type(error).__name__}: {error}"
+            else:
+                if response.status == 200:
+                    etag = response.getheader("ETag")
+                    if not etag:
+                        raise Exception(f"Uploading part {part_number} returned no ETag")
+                    return etag
+
+                failure = f"HTTP {response.status}: {body.decode(errors='replace')}"
+                if response.status != 429 and response.status < 500:
+                    raise Exception(f"Uploading part {part_number} failed with {failure}")
+            finally:
+                connection.close()
+
+            if attempt < PART_UPLOAD_ATTEMPTS:
+                time.sleep(2 ** attempt)
+
+    raise Exception(f"Uploading part {part_number} failed after {PART_UPLOAD_ATTEMPTS} attempts, last error {failure}")
+
+def check_shared_memory(needed: int):
+    """
+    Raise if /dev/shm cannot hold `needed` more bytes. Shared memory segments are
+    sparse, so creating them succeeds regardless, and the process is killed with
+    SIGBUS once writing to one runs out of space.
+    """
+    if not os.path.isdir("/dev/shm"):
+        return
+    stat = os.statvfs("/dev/shm")
+    available = stat.f_bavail * stat.f_frsize
+    if needed > available:
+        raise Exception(
+            f"Uploading needs {needed // 1024 ** 2} MiB of shared memory, but /dev/shm only has "
+            f"{available // 1024 ** 2} MiB free. Lower --part-size or --upload-workers, "
+            f"or give the container more shared memory with docker run --shm-size."
+        )
+
+def upload_multipart(
     bucket: str,
-    prefix: str,
+    key: str,
     s3_client,
-    retention_days: int,
+    endpoint_url: str | None,
+    stream: MySQLDumpStream,
+    part_size: int,
+    workers: int,
 ):
     """
-    List all objects in the bucket with the given prefix and remove any
-    that are older than `retention_days`.
-    Expects the key format:  <prefix>-YYYYMMDD-HHMMSS.sql
-    We'll parse the date from the middle portion of the filename.
+    Upload the contents of `stream` to `bucket` as `key` using a multipart upload.
+    The stream is read in `part_size` chunks into a ring of preallocated shared memory
+    segments, which are uploaded by a pool of `workers` processes in parallel. Up to
+    PREFETCH_PARTS parts are read ahead of the workers, so short stalls on either the
+    dump or the upload side do not stall the other. Reading stops at the first failed part,
+    and the upload is aborted if anything goes wrong.
+    """
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    segments = []
+    try:
+        # Segments are handed back once their part has been uploaded
+        free_segments = queue.Queue()
+        for _ in range(workers + PREFETCH_PARTS):
+            shm = SharedMemory(create=True, size=part_size)
+            segments.append(shm)
+            free_segments.put(shm)
+
+        results = []
+        # Start the resource tracker first so workers attaching to segments share it
+        resource_tracker.ensure_running()
+        # Workers are spawned rather than forked: other threads, such as the backup
+        # listing, may hold locks that a forked child would inherit in a locked state
+        context = multiprocessing.get_context("spawn")
+        # Set by the first part that fails, so the dump is not read any further
+        part_failed = Event()
+        with context.Pool(workers, initializer=init_upload_worker, initargs=(endpoint_url,)) as pool:
+            # Time each part was submitted, and the oldest part which may still be uploading
+            submitted = []
+            oldest = 0
+            part_number = 1
+            while not part_failed.is_set():
+                # A worker that dies mid-part never reports back, so give up on parts
+                # that take too long instead of waiting for them forever
+                while oldest < len(results) and results[oldest].ready():
+                    oldest += 1
+                if oldest < len(results) and time.monotonic() - submitted[oldest] > PART_TIMEOUT:
+                    raise Exception(f"Part {oldest + 1} did not finish uploading within {PART_TIMEOUT} seconds")
+                try:
+                    shm = free_segments.get(timeout=PART_TIMEOUT)
+                except queue.Empty:
+                    raise Exception(f"No part finished uploading within {PART_TIMEOUT} seconds")
+                size = stream.readinto(shm.buf)
+                # S3 requires at least one part, even if it is empty
+                if size == 0 and part_number > 1:
+                    break
+
+                def part_done(_, shm=shm):
+                    free_segments.put(shm)
+
+                def part_error(_, shm=shm):
+                    part_failed.set()
+                    free_segments.put(shm)
+
+                results.append(pool.apply_async(
+                    upload_part,
+                    (bucket, key, upload_id, part_number, shm.name, size),
+                    callback=part_done,
+                    error_callback=part_error
+                ))
+                submitted.append(time.monotonic())
+                part_number += 1
+
+            # Raises the error of the first failed part, if any
+            parts = [
+                {"PartNumber": number, "ETag": result.get(timeout=PART_TIMEOUT)}
+                for number, result in enumerate(results, start=1)
+            ]
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+def delete_backups(bucket: str, keys: list[str], s3_client):
     """
-    now = datetime.utcnow()
-    cutoff = now - timedelta(days=retention_days)
+    Delete `keys` from `bucket` with as few DeleteObjects calls as possible.
+    """
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + DELETE_BATCH_SIZE]], "Quiet": True}
+        )
+        for error in response.get("Errors", []):
+            print(f"Failed to delete {error['Key']}: {error['Message']}")
 
-    continuation_token = None
-    while True:
-        if continuation_token:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
-                Prefix=prefix,
-                ContinuationToken=continuation_token
-            )
-        else:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
-                Prefix=prefix
-            )
+def retention_cutoff(now: datetime, retention_days: int | None) -> str | None:
+    """
+    Return the timestamp `retention_days` before `now`, formatted like backup names.
+    YYYYMMDD-HHMMSS timestamps sort chronologically as strings, so backups are
+    compared against it without being parsed.
+    """
+    if retention_days is None:
+        return None
+    return (now - timedelta(days=retention_days)).strftime(TIMESTAMP_FORMAT)
 
-        if "Contents" not in response:
+def list_backups(
+    bucket: str,
+    prefix: str,
+    s3_client,
+    stop_at: str | None = None,
+) -> list[tuple[str, str, int]]:
+    """
+    Return (timestamp, key, size) of all backups in the bucket with the given prefix,
+    oldest first. If `stop_at` is given, listing stops at the first backup with a
+    timestamp at or after it.
+    Expects the key format:  <prefix>-YYYYMMDD-HHMMSS.sql.gz (or .sql)
+    Other objects under the prefix, including backups of a longer prefix, are left alone.
+    """
+    backup_key = re.compile(re.escape(prefix) + BACKUP_KEY_PATTERN)
+
+    # S3 lists keys in lexicographic, and so for our keys chronological, order
+    backups = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(Bucket=bucket, Prefix=f"{prefix}-", PaginationConfig={"PageSize": 1000})
+    for obj in pages.search("Contents[]"):
+        # Pages without any objects yield None
+        if obj is None:
+            continue
+
+        key = obj["Key"]
+        match = backup_key.fullmatch(key)
+        if match is None:
+            continue
+
+        if stop_at is not None and match[1] >= stop_at:
             break
+        backups.append((match[1], key, obj["Size"]))
 
-        for obj in response["Contents"]:
-            key = obj["Key"]
-            if not key.endswith(".sql"):
-                continue
+    return backups
 
-            try:
-                base_name = key[:-4]
-                ts_str = base_name.rsplit('-', 2)[1] + '-' + base_name.rsplit('-', 2)[2]
-                backup_time = datetime.strptime(ts_str, "%Y%m%d-%H%M%S")
-            except Exception:
-                continue
-
-            if backup_time < cutoff:
-                print(f"Deleting old backup: {key}")
-                s3_client.delete_object(Bucket=bucket, Key=key)
-
-        if response.get("IsTruncated"):
-            continuation_token = response.get("NextContinuationToken")
+def select_expired_backups(
+    backups: list[tuple[str, str, int]],
+    cutoff_str: str | None,
+    max_backups: int | None = None,
+    max_storage_bytes: int | None = None,
+) -> list[str]:
+    """
+    Return the keys of `backups`, as returned by `list_backups`, that are older than
+    `cutoff_str`, not among the newest `max_backups`, or that would push the combined
+    size of the backups kept over `max_storage_bytes`, newest first.
+    Limits which are None are not applied. The newest backup is always kept
+    unless it is older than `cutoff_str`.
+    """
+    # Walk from the newest backup; once one is expired, so are all older ones
+    expired_keys = []
+    expired = False
+    kept = 0
+    kept_size = 0
+    for timestamp, key, size in reversed(backups):
+        expired = (
+            expired
+            or (cutoff_str is not None and timestamp < cutoff_str)
+            or (max_backups is not None and kept >= max_backups)
+            or (max_storage_bytes is not None and kept > 0 and kept_size + size > max_storage_bytes)
+        )
+        if expired:
+            expired_keys.append(key)
         else:
-            break
+            kept += 1
+            kept_size += size
+
+    return expired_keys
+
+def cleanup_old_backups(
+    bucket: str,
+    backups: list[tuple[str, str, int]],
+    s3_client,
+    cutoff_str: str | None,
+    max_backups: int | None = None,
+    max_storage_bytes: int | None = None,
+):
+    """
+    Delete the backups picked by `select_expired_backups`.
+    """
+    to_delete = select_expired_backups(backups, cutoff_str, max_backups, max_storage_bytes)
+    for key in to_delete:
+        print(f"Deleting old backup: {key}")
+
+    if to_delete:
+        delete_backups(bucket, to_delete, s3_client)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -150,55 +554,96 @@ def main():
     parser.add_argument("--endpoint-url", action=EnvDefault, envvar="S3_ENDPOINT", help="S3-compatible endpoint URL (S3_ENDPOINT)")
     parser.add_argument("--prefix", action=EnvDefault, envvar="PREFIX", help="Prefix for backup file names (S3_PREFIX)")
     parser.add_argument("--retention-days", action=EnvDefault, envvar="RETENTION_DAYS", type=int, default=DEFAULT_RETENTION_DAYS, help="Number of days to keep backups (RETENTION_DAYS)")
+    parser.add_argument("--max-backups", action=EnvDefault, required=False, envvar="MAX_BACKUPS", type=int, help="Maximum number of backups to keep (MAX_BACKUPS)")
+    parser.add_argument("--max-storage-gb", action=EnvDefault, required=False, envvar="MAX_STORAGE_GB", type=float, help="Maximum combined size of backups to keep in GiB, the newest backup is always kept (MAX_STORAGE_GB)")
+    parser.add_argument("--part-size", action=EnvDefault, envvar="PART_SIZE_MB", type=int, default=DEFAULT_PART_SIZE_MB, help="Size of each uploaded part in MiB, at least 5 (PART_SIZE_MB)")
+    parser.add_argument("--upload-workers", action=EnvDefault, envvar="UPLOAD_WORKERS", type=int, default=DEFAULT_UPLOAD_WORKERS, help="Number of processes uploading parts in parallel (UPLOAD_WORKERS)")
 
     args = parser.parse_args()
+    if args.part_size < MIN_PART_SIZE_MB:
+        parser.error(f"--part-size must be at least {MIN_PART_SIZE_MB} MiB")
+    if args.max_backups is not None and args.max_backups < 1:
+        parser.error("--max-backups must be at least 1")
+    if args.max_storage_gb is not None and args.max_storage_gb <= 0:
+        parser.error("--max-storage-gb must be greater than 0")
+    if args.upload_workers < 1:
+        parser.error("--upload-workers must be at least 1")
+
+    # One segment per upload worker, plus the parts read ahead of them
+    check_shared_memory((args.upload_workers + PREFETCH_PARTS) * args.part_size * 1024 * 1024)
 
-    session = boto3.Session()
-    s3_client = session.client("s3", endpoint_url=args.endpoint_url)
+    s3_client = create_s3_client(args.endpoint_url)
 
     print("Fetching databases...")
-    user_databases = get_user_databases(args.user, args.password, args.hostname, args.port)
+    connection_args = mysql_connection_args(args.user, args.hostname, args.port)
+    env = mysql_env(args.password)
+    user_databases = get_user_databases(connection_args, env)
     if not user_databases:
         print("No non-system databases found. Exiting.")
         return
 
     print(f"Found databases: {' '.join(user_databases)}")
 
-    timestamp_str = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
-    dump_filename = f"{args.prefix}-{timestamp_str}.sql"
-    mysqldump = open_dump_process(args.user, args.password, args.hostname, args.port, user_databases)
-
-    print("Streaming mysqldump to S3...")
-
-    input_stream = MySQLDumpStream(mysqldump)
+    # Shared by the backup name and the retention cutoff
+    now = datetime.now(timezone.utc)
+    timestamp_str = now.strftime(TIMESTAMP_FORMAT)
+    dump_filename = f"{args.prefix}-{timestamp_str}.sql.gz"
+
+    # Age based retention only applies to retention periods over a day
+    retention_days = args.retention_days if args.retention_days > 1 else None
+    cutoff_str = retention_cutoff(now, retention_days)
+    max_storage_bytes = int(args.max_storage_gb * 1024 ** 3) if args.max_storage_gb is not None else None
+    cleanup = cutoff_str is not None or args.max_backups is not None or max_storage_bytes is not None
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Existing backups are listed while the dump uploads. Nothing is deleted
+        # until the new backup is stored, so a failed backup never removes old ones.
+        listing = None
+        if cleanup:
+            # With only an age limit, backups inside the retention period are never needed.
+            # Otherwise stop before the new backup, which the listing may see once the
+            # upload completes and which is added to the list separately below.
+            age_only = args.max_backups is None and max_storage_bytes is None
+            listing = executor.submit(
+                list_backups,
+                bucket=args.bucket,
+                prefix=args.prefix,
+                s3_client=s3_client,
+                stop_at=cutoff_str if age_only else timestamp_str
+            )
 
-    upload_thread = Thread(target=lambda: s3_client.upload_fileobj(input_stream, args.bucket, dump_filename))
-    upload_thread.start()
+        mysqldump = open_dump_process(connection_args, env, user_databases)
+        pigz = open_compress_process(mysqldump)
 
-    while True:
-        print(f"Uploaded {input_stream.num_read} bytes", end='\r')
-        if not upload_thread.is_alive():
-            print()
-            break
-        time.sleep(0.1)
+        print("Streaming mysqldump to S3...")
 
-    upload_thread.join()
-    mysqldump.wait()
-    if mysqldump.returncode != 0:
-        raise Exception(f"mysqldump failed: {mysqldump.stderr}")
+        input_stream = MySQLDumpStream(mysqldump, pigz)
 
-    print("Upload complete.")
-
-    retention = args.retention_days
-    if retention > 1:
-        print(f"Cleaning up backups older than {args.retention_days} days...")
-        cleanup_old_backups(
+        upload_multipart(
             bucket=args.bucket,
-            prefix=args.prefix,
+            key=dump_filename,
             s3_client=s3_client,
-            retention_days=args.retention_days
+            endpoint_url=args.endpoint_url,
+            stream=input_stream,
+            part_size=args.part_size * 1024 * 1024,
+            workers=args.upload_workers
         )
-        print("Cleanup complete.")
+        print(f"Uploaded {input_stream.num_read} bytes")
+
+        print("Upload complete.")
+
+        if listing is not None:
+            print("Cleaning up old backups...")
+            backups = listing.result() + [(timestamp_str, dump_filename, input_stream.num_read)]
+            cleanup_old_backups(
+                bucket=args.bucket,
+                backups=backups,
+                s3_client=s3_client,
+                cutoff_str=cutoff_str,
+                max_backups=args.max_backups,
+                max_storage_bytes=max_storage_bytes
+            )
+            print("Cleanup complete.")
 
     print("All done.")
 
@@ -0,0 +1,155 @@
+import unittest
+
+import backup
+
+
+def listing_client(keys: list[str]):
+    """ Return a stand-in S3 client whose list_objects_v2 paginator yields `keys` in one page """
+    class Pages:
+        def search(self, expression):
+            yield from ({"Key": key, "Size": len(key)} for key in sorted(keys))
+
+    class Paginator:
+        def paginate(self, Bucket, Prefix, PaginationConfig=None):
+            return Pages()
+
+    class Client:
+        def get_paginator(self, name):
+            return Paginator()
+
+    return Client()
+
+
+class SelectExpiredBackupsTest(unittest.TestCase):
+    # Daily backups of 100 bytes, oldest first
+    backups = [(f"202401{day:02}-000000", f"db-202401{day:02}-000000.sql.gz", 100) for day in range(1, 11)]
+
+    def test_no_limits(self):
+        self.assertEqual(backup.select_expired_backups(self.backups, None), [])
+
+    def test_age_only(self):
+        expired = backup.select_expired_backups(self.backups, "20240104-000000")
+        self.assertEqual(expired, [
+            "db-20240103-000000.sql.gz",
+            "db-20240102-000000.sql.gz",
+            "db-20240101-000000.sql.gz",
+        ])
+
+    def test_age_keeps_backup_at_cutoff(self):
+        expired = backup.select_expired_backups(self.backups, "20240101-000000")
+        self.assertEqual(expired, [])
+
+    def test_count_cap(self):
+        expired = backup.select_expired_backups(self.backups, None, max_backups=3)
+        self.assertEqual(len(expired), 7)
+        self.assertEqual(expired[0], "db-20240107-000000.sql.gz")
+        self.assertNotIn("db-20240108-000000.sql.gz", expired)
+
+    def test_size_cap(self):
+        expired = backup.select_expired_backups(self.backups, None, max_storage_bytes=250)
+        self.assertEqual(len(expired), 8)
+        self.assertEqual(expired[0], "db-20240108-000000.sql.gz")
+
+    def test_size_cap_keeps_newest(self):
+        expired = backup.select_expired_backups(self.backups, None, max_storage_bytes=50)
+        self.assertEqual(len(expired), 9)
+        self.assertNotIn("db-20240110-000000.sql.gz", expired)
+
+    def test_size_cap_expires_everything_older(self):
+        # A smaller, older backup which would still fit is not kept once a newer one was dropped
+        backups = [
+            ("20240101-000000", "db-20240101-000000.sql.gz", 10),
+            ("20240102-000000", "db-20240102-000000.sql.gz", 500),
+            ("20240103-000000", "db-20240103-000000.sql.gz", 100),
+        ]
+        expired = backup.select_expired_backups(backups, None, max_storage_bytes=200)
+        self.assertEqual(expired, ["db-20240102-000000.sql.gz", "db-20240101-000000.sql.gz"])
+
+    def test_mixed_limits(self):
+        # The count cap is the strictest here
+        expired = backup.select_expired_backups(
+            self.backups, "20240103-000000", max_backups=4, max_storage_bytes=550
+        )
+        self.assertEqual(len(expired), 6)
+        self.assertEqual(expired[0], "db-20240106-000000.sql.gz")
+
+        # The age limit is the strictest here
+        expired = backup.select_expired_backups(
+            self.backups, "20240109-000000", max_backups=4, max_storage_bytes=550
+        )
+        self.assertEqual(len(expired), 8)
+
+        # The size cap is the strictest here
+        expired = backup.select_expired_backups(
+            self.backups, "20240101-000000", max_backups=8, max_storage_bytes=150
+        )
+        self.assertEqual(len(expired), 9)
+
+    def test_age_expires_newest(self):
+        expired = backup.select_expired_backups(self.backups, "20250101-000000", max_storage_bytes=1000)
+        self.assertEqual(len(expired), 10)
+
+
+class ListBackupsTest(unittest.TestCase):
+    def test_ignores_other_objects(self):
+        client = listing_client([
+            "db-20240101-000000.sql.gz",
+            "db-staging-20240101-000000.sql.gz",
+            "db-staging-20240102-000000.sql",
+            "db-notes.txt",
+            "db-20240102-000000.sql.gz.tmp",
+        ])
+        backups = backup.list_backups("bucket", "db", client)
+        self.assertEqual(backups, [("20240101-000000", "db-20240101-000000.sql.gz", 25)])
+
+    def test_mixes_sql_and_sql_gz(self):
+        client = listing_client([
+            "db-20240103-000000.sql.gz",
+            "db-20240101-000000.sql",
+            "db-20240102-000000.sql",
+        ])
+        backups = backup.list_backups("bucket", "db", client)
+        self.assertEqual([key for _, key, _ in backups], [
+            "db-20240101-000000.sql",
+            "db-20240102-000000.sql",
+            "db-20240103-000000.sql.gz",
+        ])
+
+        expired = backup.select_expired_backups(backups, "20240102-000000")
+        self.assertEqual(expired, ["db-20240101-000000.sql"])
+
+    def test_stops_at_cutoff(self):
+        client = listing_client([
+            "db-20240101-000000.sql",
+            "db-20240102-000000.sql.gz",
+            "db-20240103-000000.sql.gz",
+            "db-staging-20230101-000000.sql.gz",
+        ])
+        backups = backup.list_backups("bucket", "db", client, stop_at="20240102-000000")
+        self.assertEqual([key for _, key, _ in backups], ["db-20240101-000000.sql"])
+
+    def test_excludes_new_backup(self):
+        # The listing runs during the upload and may already see the new backup,
+        # which main() appends itself; listing up to its timestamp must leave it out
+        new = ("20240103-000000", "db-20240103-000000.sql.gz", 100)
+        client = listing_client([
+            "db-20240101-000000.sql.gz",
+            "db-20240102-000000.sql.gz",
+            new[1],
+        ])
+        backups = backup.list_backups("bucket", "db", client, stop_at=new[0]) + [new]
+        self.assertEqual([key for _, key, _ in backups], [
+            "db-20240101-000000.sql.gz",
+            "db-20240102-000000.sql.gz",
+            new[1],
+        ])
+
+        expired = backup.select_expired_backups(backups, None, max_backups=1)
+        self.assertEqual(expired, ["db-20240102-000000.sql.gz", "db-20240101-000000.sql.gz"])
+
+        expired = backup.select_expired_backups(backups, None, max_storage_bytes=150)
+        self.assertNotIn(new[1], expired)
+
+
+if __name__ == "__main__":
+    unittest.main()